@@ -11,6 +11,8 @@ load_dotenv()
 BASE_DIR = Path(__file__).parent.parent
 DOWNLOAD_DIR = BASE_DIR / os.getenv("DOWNLOAD_DIR", "downloads")
 AUTH_FILE_PATH = BASE_DIR / os.getenv("ZSXQ_AUTH_FILE", "auth.json")
+# 文件下载链接缓存 (签名链接在过期前可复用，断点续跑时同样生效)
+URL_CACHE_PATH = BASE_DIR / os.getenv("ZSXQ_URL_CACHE_FILE", "url_cache.json")
 
 # Ensure download dir exists
 DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
@@ -20,9 +22,11 @@ FEISHU_APP_ID = os.getenv("FEISHU_APP_ID")
 FEISHU_APP_SECRET = os.getenv("FEISHU_APP_SECRET")
 FEISHU_BITABLE_APP_TOKEN = os.getenv("FEISHU_BITABLE_APP_TOKEN")
 FEISHU_TABLE_ID = os.getenv("FEISHU_TABLE_ID")
+# 多目标路由配置 (可选)：按圈子将数据写入不同的多维表格，不存在时使用上面的单表配置
+FEISHU_ROUTES_FILE = BASE_DIR / os.getenv("FEISHU_ROUTES_FILE", "feishu_routes.json")
 
 # Validation
-if not all([FEISHU_APP_ID, FEISHU_APP_SECRET, FEISHU_BITABLE_APP_TOKEN, FEISHU_TABLE_ID]):
+if not FEISHU_ROUTES_FILE.exists() and not all([FEISHU_APP_ID, FEISHU_APP_SECRET, FEISHU_BITABLE_APP_TOKEN, FEISHU_TABLE_ID]):
     logger.warning("Feishu configuration is incomplete in .env file.")
 
 # Logger Configuration
@@ -2,24 +2,60 @@ import requests
 import time
 import os
 import zlib
+import threading
 from requests_toolbelt.multipart.encoder import MultipartEncoder
 from loguru import logger
+from .profiler import profiler
+from .rate_limiter import RateLimiter
 from .config import FEISHU_APP_ID, FEISHU_APP_SECRET, FEISHU_BITABLE_APP_TOKEN, FEISHU_TABLE_ID
 
+# 飞书限流 / 写冲突错误码：稍后重试整批即可，不属于数据本身的问题
+RETRYABLE_ERROR_CODES = (
+    99991400,  # request trigger frequency limit
+    1254290,   # TooManyRequest
+    1254291,   # Write conflict
+)
+
+
+class FeishuApiError(Exception):
+    """
+    Raised when a Feishu request certainly did not take effect
+    (explicit error code, rate limiting, or failure before the request was sent).
+    :param retryable: True if retrying the same request later may succeed (rate limit, token refresh failure)
+    """
+    def __init__(self, message: str, retryable: bool = False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
 class FeishuClient:
-    def __init__(self):
-        self.app_id = FEISHU_APP_ID
-        self.app_secret = FEISHU_APP_SECRET
-        self.app_token = FEISHU_BITABLE_APP_TOKEN
-        self.table_id = FEISHU_TABLE_ID
+    def __init__(self, app_id: str = None, app_secret: str = None, app_token: str = None, table_id: str = None,
+                 limiter: RateLimiter = None):
+        """
+        默认使用 .env 中的单表配置；多目标路由时由 FeishuRouter 传入各自的应用凭证与表格。
+        :param limiter: 可选限流器，对该表的查询、上传 (含分片) 与写入请求统一限流
+        """
+        self.app_id = app_id or FEISHU_APP_ID
+        self.app_secret = app_secret or FEISHU_APP_SECRET
+        self.app_token = app_token or FEISHU_BITABLE_APP_TOKEN
+        self.table_id = table_id or FEISHU_TABLE_ID
+        self.limiter = limiter
         self.tenant_access_token = ""
         self.token_expire_time = 0
+        self._token_lock = threading.Lock()
         
+    def _throttle(self):
+        if self.limiter:
+            self.limiter.wait()
+
     def _get_token(self):
         """Get or refresh tenant_access_token"""
-        if time.time() < self.token_expire_time:
-            return self.tenant_access_token
-            
+        with self._token_lock:
+            if time.time() < self.token_expire_time:
+                return self.tenant_access_token
+            return self._refresh_token()
+
+    def _refresh_token(self):
         url = "https://open.feishu.cn/open-apis/auth/v3/tenant_access_token/internal"
         # 显式指定 Header，防止 requests 自动处理出现意外（参考用户代码）
         # 虽然 requests 默认 json=... 会带 Content-Type，但显式更安全
@@ -61,6 +97,15 @@ class FeishuClient:
         :param file_type: "image" or "file" (虽然API层都是bitable_file/image，这里做区分)
         :return: file_token
         """
+        span = profiler.start("feishu.upload", "asset", file=os.path.basename(file_path), file_type=file_type)
+        try:
+            if os.path.exists(file_path):
+                span.set(bytes=os.path.getsize(file_path))
+            return self._upload_bitable_file(file_path, file_type)
+        finally:
+            profiler.finish(span)
+
+    def _upload_bitable_file(self, file_path: str, file_type: str = "file") -> str:
         if not os.path.exists(file_path):
             logger.error(f"File not found: {file_path}")
             return None
@@ -99,6 +144,7 @@ class FeishuClient:
                     m = MultipartEncoder(form_data)
                     headers["Content-Type"] = m.content_type
                     
+                    self._throttle()
                     resp = requests.post(url, headers=headers, data=m, timeout=300)
                     # Don't raise immediately, check content first
                     res_json = resp.json()
@@ -137,6 +183,7 @@ class FeishuClient:
             "size": size
         }
         try:
+            self._throttle()
             r = requests.post(prep_url, headers={**headers, "Content-Type": "application/json"}, json=body, timeout=10)
             r.raise_for_status()
             prep = r.json().get("data", {})
@@ -161,12 +208,15 @@ class FeishuClient:
                     curr_headers = headers.copy()
                     curr_headers["Content-Type"] = mpart.content_type
                     
-                    rp = requests.post(part_url, headers=curr_headers, data=mpart, timeout=300)
+                    with profiler.span("feishu.upload_part", "api", file=file_name, seq=seq, bytes=len(chunk)):
+                        self._throttle()
+                        rp = requests.post(part_url, headers=curr_headers, data=mpart, timeout=300)
                     rp.raise_for_status()
             
             # 完成上传
             finish_url = "https://open.feishu.cn/open-apis/drive/v1/medias/upload_finish"
             f_body = {"upload_id": upload_id, "block_num": block_num}
+            self._throttle()
             rf = requests.post(finish_url, headers={**headers, "Content-Type": "application/json"}, json=f_body, timeout=10)
             rf.raise_for_status()
             return rf.json().get("data", {}).get("file_token")
@@ -195,7 +245,8 @@ class FeishuClient:
             headers = self.get_auth_headers()
             headers["Content-Type"] = "application/json; charset=utf-8"
             
-            resp = requests.post(url, json=data, headers=headers)
+            self._throttle()
+            resp = requests.post(url, json=data, headers=headers, timeout=30)
             resp.raise_for_status()
             res_json = resp.json()
             
@@ -221,7 +272,8 @@ class FeishuClient:
             headers = self.get_auth_headers()
             headers["Content-Type"] = "application/json; charset=utf-8"
             
-            resp = requests.post(url, json=data, headers=headers)
+            self._throttle()
+            resp = requests.post(url, json=data, headers=headers, timeout=30)
             resp.raise_for_status()
             res_json = resp.json()
             
@@ -235,3 +287,38 @@ class FeishuClient:
         except Exception as e:
             logger.error(f"Error adding topic: {e}")
             return None
+
+    def add_topics(self, fields_list: list):
+        """
+        批量写入记录 (batch_create，单次最多 500 条)。
+        确定未写入时抛出 FeishuApiError (飞书明确拒绝、限流、或请求发出前获取 token 失败)；
+        请求发出后的网络异常原样抛出，此时服务端可能已写入，调用方不应直接重试以免产生重复记录。
+        :return: record_id 列表
+        """
+        url = f"https://open.feishu.cn/open-apis/bitable/v1/apps/{self.app_token}/tables/{self.table_id}/records/batch_create"
+        data = {"records": [{"fields": fields} for fields in fields_list]}
+        
+        try:
+            headers = self.get_auth_headers()
+        except Exception as e:
+            raise FeishuApiError(f"Failed to get Feishu token: {e}", retryable=True)
+        headers["Content-Type"] = "application/json; charset=utf-8"
+        
+        self._throttle()
+        resp = requests.post(url, json=data, headers=headers, timeout=30)
+        if resp.status_code == 429:
+            raise FeishuApiError(f"Rate limited when batch adding records: {resp.text[:200]}", retryable=True)
+        # Don't raise immediately, check content first
+        res_json = resp.json()
+        
+        code = res_json.get("code")
+        if code != 0:
+            raise FeishuApiError(
+                f"Failed to batch add records. Status: {resp.status_code}, Response: {res_json}",
+                retryable=code in RETRYABLE_ERROR_CODES,
+            )
+        resp.raise_for_status()
+        
+        records = res_json.get("data", {}).get("records", [])
+        logger.info(f"Successfully added {len(records)} records to table {self.table_id}")
+        return [r.get("record_id") for r in records]
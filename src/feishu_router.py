@@ -0,0 +1,204 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+from .config import FEISHU_ROUTES_FILE, FEISHU_APP_ID, FEISHU_APP_SECRET
+from .feishu_client import FeishuClient, FeishuApiError
+from .profiler import profiler
+from .rate_limiter import RateLimiter
+
+# batch_create 单次最多写入 500 条
+MAX_BATCH_SIZE = 500
+# 单个目标相邻两次请求的默认最小间隔 (秒)
+DEFAULT_MIN_INTERVAL = 0.2
+# 限流等可重试错误时整批重试的次数与初始退避 (秒，指数增长)
+MAX_BATCH_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 2
+
+
+class FeishuDestination:
+    """
+    单个写入目标 (应用 + 多维表格)。
+    拥有独立的 FeishuClient、限流器、写入缓冲与写入线程：该表的查询、上传 (含分片) 与写入共用同一限流预算；
+    记录先进入缓冲，每处理完一页主题由 flush() 提交给该目标的写入线程异步批量写入，
+    不阻塞抓取，各目标之间并发写入；close() 等待全部写入完成。
+    """
+
+    def __init__(self, name: str, client: FeishuClient):
+        self.name = name
+        self.client = client
+        self._buffer = []
+        self._futures = []
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"feishu-writer-{name}")
+
+    def add_topic(self, fields: dict):
+        """将记录加入写入缓冲，调用 flush() 时批量写入"""
+        # 从当前主题 span 连到稍后写入该记录的 span
+        profiler.flow_start(fields.get("topic_id", "unknown"))
+        self._buffer.append(fields)
+
+    def flush(self):
+        """将缓冲中的记录提交给写入线程，立即返回"""
+        if not self._buffer:
+            return
+        records, self._buffer = self._buffer, []
+        self._futures.append(self._executor.submit(self._write_all, records))
+
+    def close(self) -> list:
+        """
+        提交剩余记录并等待所有写入完成。
+        :return: 写入失败 (或状态未知) 的 topic_id 列表
+        """
+        self.flush()
+        self._executor.shutdown(wait=True)
+        failed = []
+        for future in self._futures:
+            try:
+                failed.extend(future.result())
+            except Exception as e:
+                logger.exception(f"目标 {self.name} 写入线程异常: {e}")
+        self._futures = []
+        return failed
+
+    def _write_all(self, records: list) -> list:
+        failed = []
+        for start in range(0, len(records), MAX_BATCH_SIZE):
+            failed.extend(self._write_batch(records[start:start + MAX_BATCH_SIZE]))
+        return failed
+
+    def _write_batch(self, batch: list) -> list:
+        topic_ids = [fields.get("topic_id", "unknown") for fields in batch]
+        for attempt in range(MAX_BATCH_RETRIES + 1):
+            try:
+                with profiler.span("feishu.batch_write", "write", destination=self.name, topic_ids=topic_ids):
+                    self.client.add_topics(batch)
+                    for topic_id in topic_ids:
+                        profiler.flow_end(topic_id)
+                for topic_id in topic_ids:
+                    logger.success(f"主题 {topic_id} 已同步到飞书 ({self.name})。")
+                return []
+            except FeishuApiError as e:
+                if not e.retryable:
+                    # 数据被飞书拒绝时逐条重试，避免单条异常数据拖累整批
+                    logger.warning(f"目标 {self.name} 批量写入被拒绝，改为逐条写入 {len(batch)} 条记录: {e}")
+                    return self._write_one_by_one(batch, topic_ids)
+                if attempt == MAX_BATCH_RETRIES:
+                    logger.error(f"目标 {self.name} 批量写入重试 {MAX_BATCH_RETRIES} 次后仍失败: {e}")
+                    break
+                # 限流等可重试错误：通过该目标的限流器退避后重试整批
+                delay = RETRY_BACKOFF_SECONDS * (2 ** attempt)
+                logger.warning(f"目标 {self.name} 批量写入暂时失败，{delay} 秒后重试整批: {e}")
+                self.client.limiter.backoff(delay)
+            except Exception as e:
+                # 请求发出后的网络异常：服务端可能已写入，逐条重试会产生重复记录，交由下次运行去重后处理
+                logger.error(f"目标 {self.name} 批量写入出错，写入状态未知，不自动重试: {e}")
+                for topic_id in topic_ids:
+                    logger.error(f"同步主题 {topic_id} 状态未知 ({self.name})。")
+                return topic_ids
+
+        for topic_id in topic_ids:
+            logger.error(f"同步主题 {topic_id} 失败 ({self.name})。")
+        return topic_ids
+
+    def _write_one_by_one(self, batch: list, topic_ids: list) -> list:
+        failed = []
+        for fields, topic_id in zip(batch, topic_ids):
+            with profiler.span("feishu.write", "write", destination=self.name, topic_ids=[topic_id]):
+                record_id = self.client.add_topic(fields)
+                profiler.flow_end(topic_id)
+            if record_id:
+                logger.success(f"主题 {topic_id} 已同步到飞书 ({self.name})。")
+            else:
+                logger.error(f"同步主题 {topic_id} 失败 ({self.name})。")
+                failed.append(topic_id)
+        return failed
+
+
+class FeishuRouter:
+    """
+    按圈子将主题路由到不同的多维表格。
+    路由配置文件 (FEISHU_ROUTES_FILE) 示例:
+    {
+        "apps": {"other": {"app_id": "cli_xxx", "app_secret": "xxx"}},
+        "destinations": {
+            "main": {"app_token": "bascnxxx", "table_id": "tblxxx"},
+            "research": {"app": "other", "app_token": "bascnyyy", "table_id": "tblyyy", "min_interval": 0.5}
+        },
+        "routes": [
+            {"group_ids": ["28888222154481"], "destination": "research"},
+            {"name_contains": "研报", "destination": "research"}
+        ],
+        "default": "main"
+    }
+    未配置 "app" 的目标使用 .env 中的应用凭证；配置文件不存在时退化为 .env 中的单表。
+    配置错误 (未知的 app/destination、缺少 app_token/table_id 或所需的 .env 凭证) 时抛出 ValueError。
+    """
+
+    def __init__(self):
+        self.destinations = {}
+        self.routes = []
+        self.default = None
+        self._load()
+
+    def _load(self):
+        if not FEISHU_ROUTES_FILE.exists():
+            client = FeishuClient(limiter=RateLimiter(min_interval=DEFAULT_MIN_INTERVAL))
+            self.destinations["default"] = FeishuDestination("default", client)
+            self.default = "default"
+            return
+
+        with open(FEISHU_ROUTES_FILE, "r", encoding="utf-8") as f:
+            config = json.load(f)
+
+        apps = config.get("apps", {})
+        for name, dest in config.get("destinations", {}).items():
+            for key in ("app_token", "table_id"):
+                if not dest.get(key):
+                    raise ValueError(f"Feishu destination '{name}' is missing '{key}'")
+            if dest.get("app"):
+                if dest["app"] not in apps:
+                    raise ValueError(f"Unknown Feishu app '{dest['app']}' in destination '{name}'")
+                app = apps[dest["app"]]
+                if not (app.get("app_id") and app.get("app_secret")):
+                    raise ValueError(f"Feishu app '{dest['app']}' is missing 'app_id' or 'app_secret'")
+            elif not (FEISHU_APP_ID and FEISHU_APP_SECRET):
+                raise ValueError(f"Feishu destination '{name}' has no 'app' and FEISHU_APP_ID/FEISHU_APP_SECRET are not set in .env")
+            else:
+                app = {}
+            client = FeishuClient(
+                app_id=app.get("app_id"),
+                app_secret=app.get("app_secret"),
+                app_token=dest["app_token"],
+                table_id=dest["table_id"],
+                limiter=RateLimiter(min_interval=dest.get("min_interval", DEFAULT_MIN_INTERVAL)),
+            )
+            self.destinations[name] = FeishuDestination(name, client)
+
+        self.routes = config.get("routes", [])
+        self.default = config.get("default")
+        for route in self.routes:
+            if route.get("destination") not in self.destinations:
+                raise ValueError(f"Unknown Feishu destination in route: {route}")
+        if self.default and self.default not in self.destinations:
+            raise ValueError(f"Unknown default Feishu destination: {self.default}")
+        logger.info(f"已加载 {len(self.destinations)} 个飞书写入目标，{len(self.routes)} 条路由规则。")
+
+    def route(self, group_id: str, group_name: str = ""):
+        """返回圈子对应的写入目标，未匹配任何规则且无默认目标时返回 None"""
+        for route in self.routes:
+            if str(group_id) in [str(g) for g in route.get("group_ids", [])]:
+                return self.destinations[route["destination"]]
+            keyword = route.get("name_contains")
+            if keyword and keyword in (group_name or ""):
+                return self.destinations[route["destination"]]
+        if self.default:
+            return self.destinations[self.default]
+        return None
+
+    def close(self):
+        """写入所有目标缓冲中剩余的记录，并等待各目标的写入线程完成"""
+        for dest in self.destinations.values():
+            dest.flush()
+        for dest in self.destinations.values():
+            failed = dest.close()
+            if failed:
+                logger.error(f"目标 {dest.name} 有 {len(failed)} 个主题写入飞书失败或状态未知: {', '.join(failed)}")
@@ -0,0 +1,176 @@
+import json
+import time
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+from .config import URL_CACHE_PATH
+from .rate_limiter import RateLimiter
+from .zsxq_client import ZSXQClient, DownloadUrlExpiredError
+
+# 无法从链接中解析过期时间时使用的默认有效期 (秒)
+DEFAULT_URL_TTL = 600
+# 提前视为过期的安全余量 (秒)
+EXPIRE_MARGIN = 60
+# 缓存有效期上限 (秒)，防止异常的过期参数导致链接被永久缓存
+MAX_URL_TTL = 24 * 3600
+# 签名链接中可能携带过期时间戳的参数名
+EXPIRE_PARAM_NAMES = ("e", "Expires", "expires")
+
+
+class FileUrlResolver:
+    """
+    文件下载链接解析器。
+    - prefetch(): 并发解析即将处理的若干主题 (当前主题及其后几个) 的附件下载链接
+      (受限流器约束，默认约 3 次/秒)，取代原先每个文件下载前串行请求 download_url 并额外等待 2~5 秒的做法；
+      只预取一个小窗口，保证链接在使用前不会因默认有效期过短而失效
+    - 本地已存在的文件不再请求下载链接 (断点续跑时不产生额外请求)
+    - 链接按过期时间缓存，并持久化到 URL_CACHE_PATH，重试与断点续跑时直接复用
+    - download(): 下载时若遇到 403/410 (链接过期)，自动刷新链接并重试一次
+    """
+
+    def __init__(self, client: ZSXQClient, max_workers: int = 4, limiter: RateLimiter = None):
+        self.client = client
+        self.max_workers = max_workers
+        # 所有线程共享同一限流器：相邻两次 download_url 请求间隔 0.3~0.5 秒
+        self.limiter = limiter or RateLimiter(min_interval=0.3, jitter=0.2)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._cache = {}  # file_id -> {"url": str, "expire_at": float}
+        self._load_cache()
+
+    def _load_cache(self):
+        if not URL_CACHE_PATH.exists():
+            return
+        try:
+            with open(URL_CACHE_PATH, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            now = time.time()
+            self._cache = {k: v for k, v in data.items() if now < v.get("expire_at", 0) <= now + MAX_URL_TTL}
+            logger.debug(f"Loaded {len(self._cache)} cached download urls")
+        except Exception as e:
+            logger.warning(f"Failed to load url cache: {e}")
+
+    def _save_cache(self):
+        try:
+            with self._lock:
+                data = dict(self._cache)
+            with open(URL_CACHE_PATH, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+        except Exception as e:
+            logger.warning(f"Failed to save url cache: {e}")
+
+    @staticmethod
+    def _parse_expire_at(url: str):
+        """
+        尝试从签名链接的查询参数中解析过期时间，无过期参数时使用默认有效期。
+        :return: 缓存失效时间；链接已过期 (不应缓存) 时返回 None
+        """
+        now = time.time()
+        try:
+            query = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+            for name in EXPIRE_PARAM_NAMES:
+                if name in query:
+                    expire_at = float(query[name][0])
+                    if expire_at > 1e12:
+                        # 毫秒级时间戳
+                        expire_at /= 1000
+                    expire_at -= EXPIRE_MARGIN
+                    if expire_at <= now:
+                        return None
+                    return min(expire_at, now + MAX_URL_TTL)
+        except (ValueError, TypeError):
+            pass
+        return now + DEFAULT_URL_TTL - EXPIRE_MARGIN
+
+    def _get_cached(self, file_id: str):
+        with self._lock:
+            entry = self._cache.get(file_id)
+            if entry and entry["expire_at"] > time.time():
+                return entry["url"]
+            return None
+
+    def _session(self):
+        """每个线程使用独立的 Session (requests.Session 非线程安全)"""
+        if threading.current_thread() is threading.main_thread():
+            return self.client.session
+        if not hasattr(self._local, "session"):
+            self._local.session = self.client.new_session()
+        return self._local.session
+
+    def _fetch(self, file_id: str):
+        """调用接口获取新的下载链接并写入缓存"""
+        self.limiter.wait()
+        url = self.client.get_file_download_url(file_id, session=self._session())
+        if url:
+            expire_at = self._parse_expire_at(url)
+            if expire_at is None:
+                logger.warning(f"文件 {file_id} 的下载链接返回时已过期，不缓存")
+            else:
+                with self._lock:
+                    self._cache[file_id] = {"url": url, "expire_at": expire_at}
+        return url
+
+    def invalidate(self, file_id: str):
+        with self._lock:
+            self._cache.pop(file_id, None)
+
+    def resolve(self, file_id: str):
+        """获取单个文件的下载链接，优先使用缓存"""
+        file_id = str(file_id)
+        url = self._get_cached(file_id)
+        if url:
+            return url
+        url = self._fetch(file_id)
+        if url:
+            self._save_cache()
+        return url
+
+    def prefetch(self, topics: list, group_id: str):
+        """并发解析给定主题中本地尚不存在、且未缓存的附件下载链接"""
+        file_ids = []
+        for topic in topics:
+            topic_id = str(topic.get("topic_id"))
+            for f in topic.get("talk", {}).get("files", []):
+                file_id, file_name = f.get("file_id"), f.get("name")
+                if not file_id or (file_name and self.client.local_path(group_id, topic_id, file_name).exists()):
+                    continue
+                if not self._get_cached(str(file_id)):
+                    file_ids.append(str(file_id))
+
+        if not file_ids:
+            return
+
+        logger.info(f"正在预解析 {len(file_ids)} 个文件的下载链接...")
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(self._fetch, file_ids))
+        self._save_cache()
+        logger.info(f"预解析完成: {sum(1 for u in results if u)}/{len(file_ids)} 个链接可用。")
+
+    def download(self, file_id: str, group_id: str, topic_id: str, filename: str):
+        """下载文件，链接过期 (403/410) 时自动刷新并重试一次"""
+        file_id = str(file_id)
+        file_path = self.client.local_path(group_id, topic_id, filename)
+        if file_path.exists():
+            logger.debug(f"File already exists: {file_path}")
+            return str(file_path)
+
+        url = self.resolve(file_id)
+        if not url:
+            return None
+        try:
+            return self.client.download_file(url, group_id, topic_id, filename, raise_on_expired=True)
+        except DownloadUrlExpiredError:
+            logger.info(f"文件 {filename} 的下载链接已过期，正在刷新...")
+            self.invalidate(file_id)
+
+        url = self._fetch(file_id)
+        if not url:
+            return None
+        self._save_cache()
+        try:
+            return self.client.download_file(url, group_id, topic_id, filename, raise_on_expired=True)
+        except DownloadUrlExpiredError as e:
+            logger.error(f"刷新后仍无法下载 {filename}: {e}")
+            self.invalidate(file_id)
+            return None
@@ -2,15 +2,20 @@ import time
 import random
 from datetime import datetime
 from loguru import logger
-from .config import FEISHU_TABLE_ID
+from .config import BASE_DIR, FEISHU_TABLE_ID
 from .zsxq_auth import login_and_save_state
 from .zsxq_client import ZSXQClient
-from .feishu_client import FeishuClient
+from .feishu_router import FeishuRouter
+from .file_url_resolver import FileUrlResolver
+from .profiler import profiler
 from pathlib import Path
 
 import re
 import urllib.parse
 
+# 附件下载链接预取窗口 (主题数)：每个主题约耗时 30 秒以上，窗口过大时链接会在使用前过期
+PREFETCH_AHEAD_TOPICS = 3
+
 def clean_content(text):
     if not text:
         return ""
@@ -34,7 +39,177 @@ def clean_content(text):
         logger.error(f"Error cleaning content: {e}")
         return text
 
-def main():
+def process_topic(zsxq, url_resolver, destination, group_id, group_name, topic):
+    """处理单个新主题：解析内容、下载并上传图片/附件，生成的记录加入写入目标的缓冲"""
+    topic_id = str(topic.get("topic_id"))
+    logger.info(f"发现新主题: {topic_id}")
+
+    # 5. 解析内容
+    talk = topic.get("talk", {})
+    text_content = talk.get("text", "")
+    # 简单清洗，移除多余空白
+    if text_content:
+        text_content = text_content.strip()
+        # 处理hashtag
+        text_content = clean_content(text_content)
+
+    create_time_str = topic.get("create_time") # 格式如: 2025-12-17T16:31:22.245+0800
+    # 飞书日期字段需要毫秒级时间戳
+    try:
+        dt = datetime.strptime(create_time_str, "%Y-%m-%dT%H:%M:%S.%f%z")
+        create_time = int(dt.timestamp() * 1000)
+    except Exception:
+        # 兼容旧版或者不同格式，若解析失败则使用当前时间或原值(飞书会报错若格式不对)
+        try:
+            # 尝试无微秒格式
+            dt = datetime.strptime(create_time_str.split(".")[0] + "+0800", "%Y-%m-%dT%H:%M:%S%z")
+            create_time = int(dt.timestamp() * 1000)
+        except:
+            logger.warning(f"Failed to parse time: {create_time_str}, using current time")
+            create_time = int(time.time() * 1000)
+
+    # 处理图片
+    image_paths = []
+    attachment_tokens = [] # 存储飞书附件Token
+
+    images = talk.get("images", [])
+    for img in images:
+        # 优先尝试大图，其次缩略图
+        img_url = img.get("large", {}).get("url") or img.get("thumbnail", {}).get("url")
+        if img_url:
+            # 文件名: image_id.jpg
+            img_id = img.get("image_id", str(time.time()))
+            fname = f"{img_id}.jpg"
+            local_path = zsxq.download_file(img_url, group_id, topic_id, fname)
+            if local_path:
+                image_paths.append(local_path)
+                # 上传到飞书
+                logger.info(f"正在上传图片: {fname}")
+                token = destination.client.upload_bitable_file(local_path, file_type="image")
+                if token:
+                    attachment_tokens.append({"file_token": token})
+                else:
+                    logger.error(f"图片上传失败: {fname}")
+
+            # Prevent rate limiting
+            time.sleep(random.uniform(1.5, 3.5))
+
+    # 处理文件附件
+    file_paths = []
+    files = talk.get("files", [])
+    for f in files:
+        file_id = f.get("file_id")
+        file_name = f.get("name")
+        if file_id:
+            logger.info(f"正在下载文件: {file_name}")
+            # 下载链接已在 prefetch 中解析并缓存，过期时 download() 会自动刷新
+            p = url_resolver.download(file_id, group_id, topic_id, file_name)
+            if p:
+                file_paths.append(p)
+                # 上传到飞书
+                logger.info(f"正在上传文件: {file_name}")
+                token = destination.client.upload_bitable_file(p, file_type="file")
+                if token:
+                    attachment_tokens.append({"file_token": token})
+                else:
+                    logger.error(f"文件上传失败: {file_name}")
+            else:
+                logger.warning(f"无法下载文件 {file_name}")
+
+            # Prevent rate limiting (链接解析已由 FileUrlResolver 限流，这里只需为下载限流)
+            time.sleep(random.uniform(1.5, 3.5))
+
+
+    # 6. 添加到飞书
+    # 构造字段映射
+    all_files = image_paths + file_paths
+    record_fields = {
+        "topic_id": topic_id,
+        "content": text_content,
+        "create_time": create_time, 
+        "group_name": group_name,
+        "author": topic.get("show_comments", [{}])[0].get("owner", {}).get("name") if topic.get("show_comments") else "未知作者",
+        "local_files": ", ".join(all_files),
+        # 如果飞书表中包含 attachments 附件列，可以直接写入
+        "attachments": attachment_tokens,
+        "status": "Done"
+    }
+
+    # 加入写入目标的缓冲，本页处理完后批量写入
+    destination.add_topic(record_fields)
+    logger.info(f"主题 {topic_id} 已加入飞书写入缓冲 ({destination.name})。")
+
+def process_group(zsxq, router, url_resolver, group):
+    """处理单个圈子的一页主题，处理完后将记录批量写入对应的飞书表"""
+    group_id = str(group.get("group_id"))
+    group_name = group.get("name", "未知圈子")
+    logger.info(f"正在处理圈子: {group_name} ({group_id})")
+
+    destination = router.route(group_id, group_name)
+    if destination is None:
+        logger.info(f"圈子 {group_name} 未匹配任何飞书写入目标。跳过。")
+        return
+
+    # 3. 获取最近的主题 (第一页)
+    # TODO: 如需深度爬取可实现分页逻辑
+    with profiler.span("zsxq.get_topics", "api", group_id=group_id, group_name=group_name):
+        topics = zsxq.get_topics(group_id)
+    logger.info(f"从圈子获取到 {len(topics)} 个主题。")
+
+    # 4. 检查去重
+    new_topics = []
+    for topic in topics:
+        topic_id = str(topic.get("topic_id"))
+        with profiler.span("feishu.check_exists", "api", topic_id=topic_id):
+            exists = destination.client.check_exists(topic_id)
+        if exists:
+            logger.info(f"主题 {topic_id} 已存在于飞书表中。跳过。")
+            continue
+        new_topics.append(topic)
+
+    try:
+        for index, topic in enumerate(new_topics):
+            # 预先并发解析当前及随后几个主题的附件下载链接 (已缓存的不会重复请求)
+            with profiler.span("prefetch_download_urls", "api", group_id=group_id):
+                url_resolver.prefetch(new_topics[index:index + PREFETCH_AHEAD_TOPICS], group_id)
+
+            # 记录写入发生在写入线程中，trace 中通过 flow 事件与该主题 span 相连，报告中按 topic_id 计入耗时
+            with profiler.span("topic", "topic", topic_id=str(topic.get("topic_id")), group_name=group_name):
+                process_topic(zsxq, url_resolver, destination, group_id, group_name, topic)
+
+            # 限流礼让
+            wait_seconds = random.randint(20, 30)
+            logger.info(f"等待 {wait_seconds} 秒后继续...")
+            time.sleep(wait_seconds)
+    finally:
+        # 本页处理完 (或中途出错) 时将已缓冲的记录交给该目标的写入线程异步写入
+        destination.flush()
+
+def write_profile_results(top_n: int = 10):
+    """输出 trace / cProfile 文件及最慢主题报告"""
+    profile_dir = BASE_DIR / "logs"
+    profile_dir.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    profiler.write_trace(profile_dir / f"profile-{stamp}.trace.json")
+    profiler.write_cpu_profile(profile_dir / f"profile-{stamp}.prof")
+    profiler.report(top_n)
+
+def main(profile: bool = False, profile_cpu: bool = False, profile_top: int = 10):
+    """
+    :param profile: 记录各主题耗时 span，结束时输出 Chrome trace 与最慢主题报告
+    :param profile_cpu: 同时开启 cProfile (需配合 profile 使用)
+    :param profile_top: 报告中列出的最慢主题/资源数量
+    """
+    if profile:
+        profiler.enable(cpu=profile_cpu)
+    try:
+        run()
+    finally:
+        # 登录失败等提前退出时同样输出结果
+        if profile:
+            write_profile_results(profile_top)
+
+def run():
     logger.info("正在启动知识星球爬虫...")
     
     # 1. 初始化客户端
@@ -50,138 +225,30 @@ def main():
             logger.error(f"登录失败: {login_error}")
             return
 
-    feishu = FeishuClient()
+    router = FeishuRouter()
+    url_resolver = FileUrlResolver(zsxq)
     
     # 2. 获取圈子列表
     groups = zsxq.get_groups()
     logger.info(f"发现 {len(groups)} 个圈子。")
     
-    for group in groups:
-        group_id = str(group.get("group_id"))
-        group_name = group.get("name", "未知圈子")
-        logger.info(f"正在处理圈子: {group_name} ({group_id})")
-        
-        # 3. 获取最近的主题 (第一页)
-        # TODO: 如需深度爬取可实现分页逻辑
-        topics = zsxq.get_topics(group_id)
-        logger.info(f"从圈子获取到 {len(topics)} 个主题。")
-        
-        for topic in topics:
-            topic_id = str(topic.get("topic_id"))
-            
-            # 4. 检查去重
-            if feishu.check_exists(topic_id):
-                logger.info(f"主题 {topic_id} 已存在于飞书表中。跳过。")
-                continue
-            
-            logger.info(f"发现新主题: {topic_id}")
-            
-            # 5. 解析内容
-            talk = topic.get("talk", {})
-            text_content = talk.get("text", "")
-            # 简单清洗，移除多余空白
-            if text_content:
-                text_content = text_content.strip()
-                # 处理hashtag
-                text_content = clean_content(text_content)
-
-            create_time_str = topic.get("create_time") # 格式如: 2025-12-17T16:31:22.245+0800
-            # 飞书日期字段需要毫秒级时间戳
-            try:
-                dt = datetime.strptime(create_time_str, "%Y-%m-%dT%H:%M:%S.%f%z")
-                create_time = int(dt.timestamp() * 1000)
-            except Exception:
-                # 兼容旧版或者不同格式，若解析失败则使用当前时间或原值(飞书会报错若格式不对)
-                try:
-                     # 尝试无微秒格式
-                     dt = datetime.strptime(create_time_str.split(".")[0] + "+0800", "%Y-%m-%dT%H:%M:%S%z")
-                     create_time = int(dt.timestamp() * 1000)
-                except:
-                     logger.warning(f"Failed to parse time: {create_time_str}, using current time")
-                     create_time = int(time.time() * 1000)
-            
-            # 处理图片
-            image_paths = []
-            attachment_tokens = [] # 存储飞书附件Token
-            
-            images = talk.get("images", [])
-            for img in images:
-                # 优先尝试大图，其次缩略图
-                img_url = img.get("large", {}).get("url") or img.get("thumbnail", {}).get("url")
-                if img_url:
-                    # 文件名: image_id.jpg
-                    img_id = img.get("image_id", str(time.time()))
-                    fname = f"{img_id}.jpg"
-                    local_path = zsxq.download_file(img_url, group_id, topic_id, fname)
-                    if local_path:
-                        image_paths.append(local_path)
-                        # 上传到飞书
-                        logger.info(f"正在上传图片: {fname}")
-                        token = feishu.upload_bitable_file(local_path, file_type="image")
-                        if token:
-                            attachment_tokens.append({"file_token": token})
-                        else:
-                             logger.error(f"图片上传失败: {fname}")
-                    
-                    # Prevent rate limiting
-                    time.sleep(random.uniform(1.5, 3.5))
-            
-            # 处理文件附件
-            file_paths = []
-            files = talk.get("files", [])
-            for f in files:
-                file_id = f.get("file_id")
-                file_name = f.get("name")
-                if file_id:
-                     url = zsxq.get_file_download_url(file_id)
-                     if url:
-                         logger.info(f"正在下载文件: {file_name}")
-                         p = zsxq.download_file(url, group_id, topic_id, file_name)
-                         if p:
-                             file_paths.append(p)
-                             # 上传到飞书
-                             logger.info(f"正在上传文件: {file_name}")
-                             token = feishu.upload_bitable_file(p, file_type="file")
-                             if token:
-                                 attachment_tokens.append({"file_token": token})
-                             else:
-                                 logger.error(f"文件上传失败: {file_name}")
-                         
-                         # Prevent rate limiting
-                         time.sleep(random.uniform(2, 5))
-                     else:
-                         logger.warning(f"无法获取文件 {file_name} 的下载链接")
-
-            
-            # 6. 添加到飞书
-            # 构造字段映射
-            all_files = image_paths + file_paths
-            record_fields = {
-                "topic_id": topic_id,
-                "content": text_content,
-                "create_time": create_time, 
-                "group_name": group_name,
-                "author": topic.get("show_comments", [{}])[0].get("owner", {}).get("name") if topic.get("show_comments") else "未知作者",
-                "local_files": ", ".join(all_files),
-                # 如果飞书表中包含 attachments 附件列，可以直接写入
-                "attachments": attachment_tokens,
-                "status": "Done"
-            }
-            
-            res = feishu.add_topic(record_fields)
-            if res:
-                logger.success(f"主题 {topic_id} 已同步到飞书。")
-            else:
-                logger.error(f"同步主题 {topic_id} 失败。")
-                
-            # 限流礼让
-            wait_seconds = random.randint(20, 30)
-            logger.info(f"等待 {wait_seconds} 秒后继续...")
-            time.sleep(wait_seconds)
+    try:
+        for group in groups:
+            process_group(zsxq, router, url_resolver, group)
+    finally:
+        # 写入所有目标缓冲中剩余的记录
+        router.close()
 
 if __name__ == "__main__":
     # 确保当前目录在 sys.path 中，防止脚本直接运行时的相对导入错误
     import sys
     import os
+    import argparse
     sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-    main()
+
+    parser = argparse.ArgumentParser(description="知识星球 -> 飞书多维表格同步工具")
+    parser.add_argument("--profile", action="store_true", help="记录耗时 span，输出 Chrome trace 及最慢主题报告到 logs/")
+    parser.add_argument("--profile-cpu", action="store_true", help="同时开启 cProfile 统计 CPU 耗时")
+    parser.add_argument("--profile-top", type=int, default=10, help="报告中列出的最慢主题/资源数量")
+    args = parser.parse_args()
+    main(profile=args.profile or args.profile_cpu, profile_cpu=args.profile_cpu, profile_top=args.profile_top)
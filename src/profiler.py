@@ -0,0 +1,185 @@
+import io
+import json
+import time
+import os
+import threading
+import cProfile
+import pstats
+from contextlib import contextmanager
+from loguru import logger
+
+
+class Span:
+    """一次计时区间，可通过 set() 追加字节数等附加信息"""
+
+    __slots__ = ("name", "category", "args", "start", "tid", "thread_name")
+
+    def __init__(self, name: str, category: str, args: dict):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = time.perf_counter()
+        self.tid = threading.get_ident()
+        # 在记录时保存线程名，写出 trace 时工作线程可能已经退出
+        self.thread_name = threading.current_thread().name
+
+    def set(self, **kwargs):
+        self.args.update(kwargs)
+
+
+class _NullSpan:
+    """未开启 profile 时返回的空 Span，所有操作均为空操作"""
+
+    def set(self, **kwargs):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Profiler:
+    """
+    轻量级 profile 工具 (通过 `--profile` 开启)。
+    - span()/start()/finish(): 记录各阶段耗时，输出为 Chrome trace-event JSON
+      (可在 chrome://tracing 或 https://ui.perfetto.dev 中打开)
+    - 可选 cProfile: 统计主线程 CPU 耗时，输出 .prof 文件
+    - flow_start()/flow_end(): 用 flow 事件把主题 span 与其记录的写入 span (在写入线程中) 连接起来
+    - report(): 输出最慢的主题与资源 (下载/上传) 排行
+    未开启时所有调用均为空操作。
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._events = []
+        self._thread_names = {}
+        self._origin = time.perf_counter()
+        self._cpu_profile = None
+
+    def enable(self, cpu: bool = False):
+        self.enabled = True
+        self._origin = time.perf_counter()
+        if cpu:
+            self._cpu_profile = cProfile.Profile()
+            self._cpu_profile.enable()
+
+    def start(self, name: str, category: str = "", **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(name, category, args)
+
+    def finish(self, span):
+        if not self.enabled or span is NULL_SPAN:
+            return
+        end = time.perf_counter()
+        event = {
+            "name": span.name,
+            "cat": span.category,
+            "ph": "X",
+            "ts": (span.start - self._origin) * 1e6,
+            "dur": (end - span.start) * 1e6,
+            "pid": os.getpid(),
+            "tid": span.tid,
+            "args": span.args,
+        }
+        with self._lock:
+            self._events.append(event)
+            self._thread_names[span.tid] = span.thread_name
+
+    @contextmanager
+    def span(self, name: str, category: str = "", **args):
+        s = self.start(name, category, **args)
+        try:
+            yield s
+        finally:
+            self.finish(s)
+
+    def _flow(self, phase: str, flow_id: str, name: str):
+        if not self.enabled:
+            return
+        event = {
+            "name": name,
+            "cat": "flow",
+            "ph": phase,
+            "id": str(flow_id),
+            "ts": (time.perf_counter() - self._origin) * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+        }
+        if phase == "f":
+            # 绑定到当前所在的 span (而不是下一个 span)
+            event["bp"] = "e"
+        with self._lock:
+            self._events.append(event)
+            self._thread_names[event["tid"]] = threading.current_thread().name
+
+    def flow_start(self, flow_id: str, name: str = "record_write"):
+        """在当前 span 内发出 flow 起点，须在对应 span 进行中调用"""
+        self._flow("s", flow_id, name)
+
+    def flow_end(self, flow_id: str, name: str = "record_write"):
+        """在当前 span 内发出 flow 终点，与 flow_start 的同名同 id 事件相连"""
+        self._flow("f", flow_id, name)
+
+    def write_trace(self, path):
+        with self._lock:
+            events = list(self._events)
+            thread_names = dict(self._thread_names)
+        for tid, name in thread_names.items():
+            events.append({
+                "name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid,
+                "args": {"name": name},
+            })
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+        logger.info(f"Trace 已写入: {path}")
+
+    def write_cpu_profile(self, path, top_n: int = 20):
+        if self._cpu_profile is None:
+            return
+        self._cpu_profile.disable()
+        self._cpu_profile.dump_stats(str(path))
+        out = io.StringIO()
+        pstats.Stats(self._cpu_profile, stream=out).sort_stats("cumulative").print_stats(top_n)
+        logger.info(f"cProfile 结果已写入: {path}\n{out.getvalue()}")
+
+    def report(self, top_n: int = 10):
+        """
+        输出最慢的主题与资源排行。
+        主题耗时 = 主题处理耗时 + 记录写入耗时 (批量写入的耗时按条数平均分摊到各主题)。
+        """
+        with self._lock:
+            events = list(self._events)
+
+        write_time = {}
+        for e in events:
+            if e.get("cat") != "write":
+                continue
+            topic_ids = e["args"].get("topic_ids") or []
+            for topic_id in topic_ids:
+                write_time[topic_id] = write_time.get(topic_id, 0) + e["dur"] / len(topic_ids)
+
+        topics = []
+        for e in events:
+            if e.get("cat") == "topic":
+                written = write_time.get(e["args"].get("topic_id"), 0)
+                topics.append((e["dur"] + written, e["dur"], written, e))
+        topics.sort(key=lambda t: t[0], reverse=True)
+        assets = sorted((e for e in events if e.get("cat") == "asset"), key=lambda e: e["dur"], reverse=True)
+
+        lines = [f"===== 最慢的 {top_n} 个主题 ====="]
+        for total, processed, written, e in topics[:top_n]:
+            lines.append(
+                f"{total / 1e6:8.2f}s  (处理 {processed / 1e6:.2f}s + 写入 {written / 1e6:.2f}s)  "
+                f"topic {e['args'].get('topic_id')}  ({e['args'].get('group_name', '')})"
+            )
+        lines.append(f"===== 最慢的 {top_n} 个资源 =====")
+        for e in assets[:top_n]:
+            size = e["args"].get("bytes")
+            size_str = f"{size / 1024:.1f} KB" if size else "-"
+            lines.append(f"{e['dur'] / 1e6:8.2f}s  {e['name']:<16} {size_str:>12}  {e['args'].get('file', '')}")
+        logger.info("\n".join(lines))
+
+
+# 全局实例，供各客户端埋点使用
+profiler = Profiler()
@@ -0,0 +1,31 @@
+import time
+import random
+import threading
+
+
+class RateLimiter:
+    """
+    线程安全的简单限流器：保证相邻两次调用之间至少间隔 min_interval 秒，
+    并叠加 0 ~ jitter 秒的随机抖动，模拟人工访问节奏。
+    """
+
+    def __init__(self, min_interval: float, jitter: float = 0.0):
+        self.min_interval = min_interval
+        self.jitter = jitter
+        self._lock = threading.Lock()
+        self._next_time = 0.0
+
+    def wait(self):
+        """阻塞直到允许下一次调用"""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_time)
+            self._next_time = start + self.min_interval + random.uniform(0, self.jitter)
+        delay = start - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def backoff(self, seconds: float):
+        """被服务端限流时调用：推迟下一次允许调用的时间"""
+        with self._lock:
+            self._next_time = max(self._next_time, time.monotonic() + seconds)
@@ -6,6 +6,16 @@ from datetime import datetime
 from pathlib import Path
 from loguru import logger
 from .config import AUTH_FILE_PATH, DOWNLOAD_DIR
+from .profiler import profiler
+
+# 签名下载链接过期时服务端返回的状态码
+EXPIRED_URL_STATUS_CODES = (403, 410)
+
+
+class DownloadUrlExpiredError(Exception):
+    """Raised when a signed download URL has expired (HTTP 403/410)"""
+    pass
+
 
 class ZSXQClient:
     def __init__(self):
@@ -65,6 +75,13 @@ class ZSXQClient:
             logger.error(f"Failed to load auth data: {e}")
             raise
 
+    def new_session(self) -> requests.Session:
+        """Create a separate session sharing this client's cookies and headers (requests.Session is not thread-safe)"""
+        session = requests.Session()
+        session.headers.update(self.session.headers)
+        session.cookies.update(self.session.cookies)
+        return session
+
     def get_groups(self):
         """Fetch all joined groups (planets)"""
         url = "https://api.zsxq.com/v2/groups"
@@ -98,37 +115,58 @@ class ZSXQClient:
             logger.error(f"Failed to fetch topics for group {group_id}: {e}")
             return []
             
-    def get_file_download_url(self, file_id: str):
-        """Fetch the download URL for a specific file"""
+    def get_file_download_url(self, file_id: str, session: requests.Session = None):
+        """
+        Fetch the download URL for a specific file
+        :param session: optional session to use instead of self.session (e.g. one per worker thread)
+        """
         url = f"https://api.zsxq.com/v2/files/{file_id}/download_url"
         try:
-            resp = self.session.get(url)
+            with profiler.span("zsxq.download_url", "api", file_id=str(file_id)):
+                resp = (session or self.session).get(url)
             resp.raise_for_status()
             return resp.json().get("resp_data", {}).get("download_url")
         except Exception as e:
             logger.error(f"Failed to get download url for file {file_id}: {e}")
             return None
             
-    def download_file(self, url: str, group_id: str, topic_id: str, filename: str):
-        """Download a file (image/attachment)"""
-        save_dir = DOWNLOAD_DIR / str(group_id) / str(topic_id)
-        save_dir.mkdir(parents=True, exist_ok=True)
-        file_path = save_dir / filename
+    def local_path(self, group_id: str, topic_id: str, filename: str) -> Path:
+        """Local path a downloaded file is saved to"""
+        return DOWNLOAD_DIR / str(group_id) / str(topic_id) / filename
+
+    def download_file(self, url: str, group_id: str, topic_id: str, filename: str, raise_on_expired: bool = False):
+        """
+        Download a file (image/attachment)
+        :param raise_on_expired: raise DownloadUrlExpiredError on 403/410 instead of returning None,
+                                 so callers holding a signed URL can refresh it and retry
+        """
+        file_path = self.local_path(group_id, topic_id, filename)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
         
         if file_path.exists():
             logger.debug(f"File already exists: {file_path}")
             return str(file_path)
             
+        span = profiler.start("zsxq.download", "asset", file=filename, topic_id=str(topic_id))
         try:
             # Use stream to handle large files
             with self.session.get(url, stream=True) as r:
+                if raise_on_expired and r.status_code in EXPIRED_URL_STATUS_CODES:
+                    raise DownloadUrlExpiredError(f"Download URL expired ({r.status_code}): {url}")
                 r.raise_for_status()
+                size = 0
                 with open(file_path, 'wb') as f:
                     for chunk in r.iter_content(chunk_size=8192): 
                         f.write(chunk)
+                        size += len(chunk)
             
+            span.set(bytes=size)
             logger.info(f"Downloaded: {file_path}")
             return str(file_path)
+        except DownloadUrlExpiredError:
+            raise
         except Exception as e:
             logger.error(f"Failed to download {url}: {e}")
             return None
+        finally:
+            profiler.finish(span)